@@ -1,15 +1,20 @@
+import logging
 import os
-from datetime import datetime, timezone
+import time
 from typing import List, Optional, Dict
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 
-from database import db, create_document, get_documents
+from database import db, create_document, create_documents, get_documents
+from rollup import MONTH_KEY_EXPR, rollup_month, summarize_rollup
 from schemas import Transaction as TransactionSchema, Category as CategorySchema
 
-app = FastAPI(title="Money Tracker API")
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Money Tracker API", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,19 +24,97 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --------- Startup ---------
+
+# Each setup step is tried on its own so one failure (e.g. an unreachable
+# database or a conflicting index) cannot skip the others. Failed steps are
+# retried at most every SETUP_RETRY_SECONDS from the handlers that need them;
+# /test reports which steps are still pending.
+SETUP_RETRY_SECONDS = float(os.getenv("SETUP_RETRY_SECONDS", 60))
+_setup_done: Dict[str, bool] = {
+    "transaction_date_index": False,
+    "category_name_index": False,
+    "summary_rollup_backfill": False,
+    "summary_rollup_index": False,
+}
+_setup_next_attempt = 0.0
+
+async def _create_transaction_date_index():
+    # Backs the date-desc sort + limit in /transactions
+    await db["transaction"].create_index([("date", -1)])
+
+async def _create_category_name_index():
+    # Category names are unique; enforced by Mongo rather than a pre-check
+    try:
+        await db["category"].create_index("name", unique=True)
+    except DuplicateKeyError:
+        # Older seeding could race and insert the defaults twice; nothing is deleted here
+        logger.warning(
+            "category has duplicate names, so the unique name index was not built; "
+            "POST /categories cannot reject duplicates until they are removed"
+        )
+        raise
+
+async def _create_summary_rollup_index():
+    await db["summary_rollup"].create_index([("month", 1), ("category", 1), ("type", 1)], unique=True)
+
+async def ensure_setup(force: bool = False):
+    global _setup_next_attempt
+    if db is None or all(_setup_done.values()):
+        return
+    now = time.monotonic()
+    if not force and now < _setup_next_attempt:
+        return
+    _setup_next_attempt = now + SETUP_RETRY_SECONDS
+    steps = [
+        ("transaction_date_index", _create_transaction_date_index),
+        ("category_name_index", _create_category_name_index),
+        ("summary_rollup_backfill", _backfill_summary_rollup),
+        ("summary_rollup_index", _create_summary_rollup_index),
+    ]
+    for name, step in steps:
+        if _setup_done[name]:
+            continue
+        try:
+            await step()
+            _setup_done[name] = True
+        except PyMongoError as e:
+            logger.warning("Setup step %s failed (%s); retrying in %ss", name, e, SETUP_RETRY_SECONDS)
+
+@app.on_event("startup")
+async def on_startup():
+    # An unreachable database must not stop the app from serving; /test reports that state
+    await ensure_setup(force=True)
+
 # --------- Helpers ---------
 
-def to_serializable(doc):
-    if not doc:
-        return doc
-    d = dict(doc)
-    if "_id" in d:
-        d["id"] = str(d.pop("_id"))
-    # Convert datetimes to isoformat
-    for k, v in list(d.items()):
-        if isinstance(v, datetime):
-            d[k] = v.astimezone(timezone.utc).isoformat()
-    return d
+# Response shapes are fixed per collection: every schema field plus the
+# timestamps is always present (null when the document lacks it), and any
+# other stored keys are left out. datetimes pass through as stored: the client
+# reads them UTC-aware and writes are UTC-aware, so no per-field conversion.
+
+def serialize_category(d):
+    return {
+        "id": str(d["_id"]),
+        "name": d.get("name"),
+        "icon": d.get("icon"),
+        "color": d.get("color"),
+        "created_at": d.get("created_at"),
+        "updated_at": d.get("updated_at"),
+    }
+
+def serialize_transaction(d):
+    return {
+        "id": str(d["_id"]),
+        "amount": d.get("amount"),
+        "type": d.get("type"),
+        "category": d.get("category"),
+        "merchant": d.get("merchant"),
+        "note": d.get("note"),
+        "date": d.get("date"),
+        "created_at": d.get("created_at"),
+        "updated_at": d.get("updated_at"),
+    }
 
 # --------- Health / Test ---------
 
@@ -40,14 +123,15 @@ def read_root():
     return {"message": "Money Tracker Backend Running"}
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
         "database_url": None,
         "database_name": None,
         "connection_status": "Not Connected",
-        "collections": []
+        "collections": [],
+        "setup_pending": [name for name, done in _setup_done.items() if not done],
     }
     try:
         if db is not None:
@@ -56,7 +140,7 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -78,8 +162,8 @@ class CategoryCreate(CategorySchema):
 # --------- Categories ---------
 
 @app.get("/categories")
-def list_categories():
-    items = get_documents("category", {})
+async def list_categories():
+    items = await get_documents("category", {})
     # Seed defaults if empty
     if not items:
         defaults = [
@@ -89,89 +173,138 @@ def list_categories():
             {"name": "Dining", "icon": "Utensils", "color": "rose"},
             {"name": "Salary", "icon": "Banknote", "color": "amber"},
         ]
-        for c in defaults:
-            create_document("category", c)
-        items = get_documents("category", {})
-    return [to_serializable(x) for x in items]
+        try:
+            items = await create_documents("category", defaults)
+        except BulkWriteError:
+            # Another request seeded concurrently
+            items = await get_documents("category", {})
+    return [serialize_category(x) for x in items]
 
 @app.post("/categories")
-def create_category(payload: CategoryCreate):
-    # Prevent duplicates by name
-    existing = db["category"].find_one({"name": payload.name})
-    if existing:
+async def create_category(payload: CategoryCreate):
+    await ensure_setup()
+    # Without the unique index (not built yet, or blocked by existing duplicates) fall back to a pre-check
+    if not _setup_done["category_name_index"]:
+        if await db["category"].find_one({"name": payload.name}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="Category already exists")
+    try:
+        doc = await create_document("category", payload)
+    except DuplicateKeyError:
         raise HTTPException(status_code=400, detail="Category already exists")
-    new_id = create_document("category", payload)
-    doc = db["category"].find_one({"_id": ObjectId(new_id)})
-    return to_serializable(doc)
+    return serialize_category(doc)
 
 # --------- Transactions ---------
 
 @app.get("/transactions")
-def list_transactions(limit: Optional[int] = 200):
-    docs = get_documents("transaction", {}, limit=limit)
-    # Sort by date desc if available, else by created_at
-    docs.sort(key=lambda d: d.get("date", d.get("created_at", datetime(1970,1,1))), reverse=True)
-    return [to_serializable(x) for x in docs]
+async def list_transactions(limit: Optional[int] = 200):
+    await ensure_setup()
+    # Newest first; sort + limit run server-side on the date index
+    docs = await get_documents("transaction", {}, limit=limit, sort=[("date", -1)])
+    return [serialize_transaction(x) for x in docs]
 
 @app.post("/transactions")
-def add_transaction(payload: TransactionCreate):
-    data = payload.model_dump()
-    # Default date
-    if not data.get("date"):
-        data["date"] = datetime.now(timezone.utc)
-    new_id = create_document("transaction", data)
-    doc = db["transaction"].find_one({"_id": ObjectId(new_id)})
-    return to_serializable(doc)
+async def add_transaction(payload: TransactionCreate):
+    doc = await create_document("transaction", payload)
+    _invalidate_summary()
+    # The transaction is already saved; a rollup failure must not turn into a 500 (and a client retry)
+    try:
+        await _update_summary_rollup(doc)
+    except PyMongoError:
+        logger.exception(
+            "summary_rollup missed transaction %s; delete the %s marker from meta and restart to rebuild it",
+            doc["_id"],
+            ROLLUP_MARKER_ID,
+        )
+    else:
+        # A summary computed while the rollup was being updated must not stay cached
+        _invalidate_summary()
+    return serialize_transaction(doc)
 
 # --------- Analytics ---------
 
-@app.get("/summary")
-def get_summary():
-    txs = get_documents("transaction", {})
-    total_expense = 0.0
-    total_income = 0.0
-    by_category: Dict[str, float] = {}
-    monthly: Dict[str, Dict[str, float]] = {}
-
-    for t in txs:
-        amt = float(t.get("amount", 0))
-        ttype = t.get("type", "expense")
-        cat = t.get("category", "Uncategorized")
-        dt = t.get("date") or t.get("created_at")
-        if isinstance(dt, datetime):
-            month_key = dt.strftime("%Y-%m")
-        else:
-            month_key = "unknown"
+# Summary results are cached in-process. The version is bumped on every
+# transaction write; the TTL bounds staleness from writers in other processes.
+SUMMARY_TTL_SECONDS = float(os.getenv("SUMMARY_TTL_SECONDS", 30))
+_transactions_version = 0
+_summary_cache: Dict[str, object] = {"version": None, "expires": 0.0, "value": None}
 
-        if ttype == "expense":
-            total_expense += amt
-            by_category[cat] = by_category.get(cat, 0) + amt
-            monthly.setdefault(month_key, {"expense": 0.0, "income": 0.0})
-            monthly[month_key]["expense"] += amt
-        else:
-            total_income += amt
-            monthly.setdefault(month_key, {"expense": 0.0, "income": 0.0})
-            monthly[month_key]["income"] += amt
+def _invalidate_summary():
+    global _transactions_version
+    _transactions_version += 1
 
-    net = total_income - total_expense
-    # top categories
-    top_categories = sorted([{"category": k, "total": v} for k, v in by_category.items()], key=lambda x: x["total"], reverse=True)[:5]
+async def _summary_cached():
+    now = time.monotonic()
+    if _summary_cache["version"] == _transactions_version and now < _summary_cache["expires"]:
+        return _summary_cache["value"]
+    version = _transactions_version
+    value = await _compute_summary()
+    _summary_cache.update(version=version, expires=now + SUMMARY_TTL_SECONDS, value=value)
+    return value
 
-    return {
-        "total_expense": round(total_expense, 2),
-        "total_income": round(total_income, 2),
-        "net": round(net, 2),
-        "by_category": by_category,
-        "monthly": monthly,
-        "top_categories": top_categories,
-        "count": len(txs),
-    }
+ROLLUP_MARKER_ID = "summary_rollup_backfill"
+
+@app.get("/summary")
+async def get_summary():
+    return await _summary_cached()
+
+async def _backfill_summary_rollup():
+    # Runs once per database: a marker written after $out completes gates it.
+    # The collection existing is not enough, since $inc upserts from
+    # add_transaction can create it before any backfill has succeeded.
+    # Re-running $out over a live rollup would race with other processes' $inc.
+    # To rebuild after drift, delete the marker from meta and restart.
+    if await db["meta"].find_one({"_id": ROLLUP_MARKER_ID}):
+        return
+    # One row per (month, category, type) with running total/count
+    pipeline = [
+        {"$project": {"_id": 0, "amount": 1, "type": 1, "category": 1, "date": 1, "created_at": 1}},
+        {"$group": {
+            "_id": {
+                "month": MONTH_KEY_EXPR,
+                "category": {"$ifNull": ["$category", "Uncategorized"]},
+                "type": {"$ifNull": ["$type", "expense"]},
+            },
+            "total": {"$sum": "$amount"},
+            "count": {"$sum": 1},
+        }},
+        {"$project": {"_id": 0, "month": "$_id.month", "category": "$_id.category", "type": "$_id.type", "total": 1, "count": 1}},
+        {"$out": "summary_rollup"},
+    ]
+    await db["transaction"].aggregate(pipeline).to_list(length=None)
+    await db["meta"].update_one(
+        {"_id": ROLLUP_MARKER_ID},
+        {"$currentDate": {"completed_at": True}},
+        upsert=True,
+    )
+
+async def _update_summary_rollup(doc):
+    await db["summary_rollup"].update_one(
+        {
+            "month": rollup_month(doc),
+            "category": doc.get("category", "Uncategorized"),
+            "type": doc.get("type", "expense"),
+        },
+        {"$inc": {"total": float(doc.get("amount", 0)), "count": 1}},
+        upsert=True,
+    )
+
+async def _compute_summary():
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not available")
+    await ensure_setup()
+    # Serving a partial rollup would silently under-report; better to say it is not ready
+    if not _setup_done["summary_rollup_backfill"]:
+        raise HTTPException(status_code=503, detail="Summary not available yet; rollup backfill pending")
+    # Reads the pre-aggregated rollup, which stays small regardless of transaction count.
+    # Rows are folded in as batches arrive rather than materialized into a list first.
+    cursor = db["summary_rollup"].find({}, {"_id": 0}).batch_size(1000)
+    return await summarize_rollup(cursor)
 
 # --------- Recommendations (Heuristic AI) ---------
 
 @app.get("/recommendations")
-def recommendations():
-    s = get_summary()
+async def recommendations():
+    s = await _summary_cached()
     recs = []
 
     # Savings rate
@@ -221,16 +354,14 @@ def recommendations():
         })
 
     # Emergency fund suggestion
-    avg_monthly_expense = 0.0
-    if s.get("monthly"):
-        avg_monthly_expense = sum(v["expense"] for v in s["monthly"].values()) / max(len(s["monthly"]), 1)
-        if avg_monthly_expense > 0:
-            target_fund = avg_monthly_expense * 3
-            recs.append({
-                "title": "Build an emergency fund",
-                "advice": f"Aim for about ${target_fund:,.0f} (≈3 months of expenses) as a buffer.",
-                "metric": round(target_fund, 2)
-            })
+    avg_monthly_expense = s.get("avg_monthly_expense", 0.0)
+    if avg_monthly_expense > 0:
+        target_fund = avg_monthly_expense * 3
+        recs.append({
+            "title": "Build an emergency fund",
+            "advice": f"Aim for about ${target_fund:,.0f} (≈3 months of expenses) as a buffer.",
+            "metric": round(target_fund, 2)
+        })
 
     return {"recommendations": recs, "summary": s}
 
@@ -0,0 +1,82 @@
+"""
+Summary Rollup Helpers
+
+Month bucketing shared by the summary_rollup backfill pipeline and the
+per-transaction $inc path. Both sides must produce the same key for the
+same document, so the Python and Mongo versions live side by side.
+Also folds rollup rows into the /summary response.
+"""
+
+import heapq
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Months are bucketed as year * 12 + (month - 1) and only formatted as
+# "YYYY-MM" when the summary is returned; None means no usable date.
+# Mongo mirror of rollup_month(): date falls back to created_at, non-dates map to null.
+MONTH_KEY_EXPR = {"$let": {
+    "vars": {"d": {"$ifNull": ["$date", "$created_at"]}},
+    "in": {"$cond": [
+        {"$eq": [{"$type": "$$d"}, "date"]},
+        {"$add": [{"$multiply": [{"$year": "$$d"}, 12]}, {"$month": "$$d"}, -1]},
+        None,
+    ]},
+}}
+
+def month_key(dt) -> Optional[int]:
+    """Integer month bucket in UTC, matching $year/$month"""
+    if not isinstance(dt, datetime):
+        return None
+    # Naive values are stored by pymongo as UTC, so only aware ones are converted
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return dt.year * 12 + dt.month - 1
+
+def rollup_month(doc: dict) -> Optional[int]:
+    """Month bucket for a transaction document, falling back to created_at"""
+    return month_key(doc.get("date") or doc.get("created_at"))
+
+def format_month(key: Optional[int]) -> str:
+    """Render a month bucket as YYYY-MM, or "unknown" for None"""
+    if key is None:
+        return "unknown"
+    return f"{key // 12:04d}-{key % 12 + 1:02d}"
+
+async def summarize_rollup(rows) -> dict:
+    """Fold rollup rows from an async iterable (e.g. a Motor cursor) into the /summary response"""
+    total_expense = 0.0
+    total_income = 0.0
+    count = 0
+    by_category: Dict[str, float] = {}
+    monthly: Dict[Optional[int], Dict[str, float]] = {}
+
+    async for r in rows:
+        month, cat, ttype, amt = r["month"], r["category"], r["type"], float(r["total"])
+        count += r["count"]
+        bucket = monthly.get(month)
+        if bucket is None:
+            bucket = monthly[month] = {"expense": 0.0, "income": 0.0}
+        if ttype == "expense":
+            total_expense += amt
+            by_category[cat] = by_category.get(cat, 0) + amt
+            bucket["expense"] += amt
+        else:
+            total_income += amt
+            bucket["income"] += amt
+
+    net = total_income - total_expense
+    # Every expense lands in exactly one month bucket, so this equals the mean of monthly expenses
+    avg_monthly_expense = total_expense / len(monthly) if monthly else 0.0
+    # top categories
+    top_categories = heapq.nlargest(5, ({"category": k, "total": v} for k, v in by_category.items()), key=lambda x: x["total"])
+
+    return {
+        "total_expense": round(total_expense, 2),
+        "total_income": round(total_income, 2),
+        "net": round(net, 2),
+        "by_category": by_category,
+        "monthly": {format_month(k): v for k, v in monthly.items()},
+        "top_categories": top_categories,
+        "avg_monthly_expense": round(avg_monthly_expense, 2),
+        "count": count,
+    }
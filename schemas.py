@@ -10,9 +10,9 @@ Model name is converted to lowercase for the collection name:
 - Category -> "category" collection
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional, Literal
-from datetime import datetime
+from datetime import datetime, timezone
 
 # Core app schemas
 
@@ -27,7 +27,17 @@ class Transaction(BaseModel):
     category: str = Field(..., description="Category name")
     merchant: Optional[str] = Field(None, description="Merchant or source")
     note: Optional[str] = Field(None, description="Optional note")
-    date: Optional[datetime] = Field(None, description="ISO date of transaction; defaults to now")
+    date: Optional[datetime] = Field(None, validate_default=True, description="ISO date of transaction; defaults to now")
+
+    @field_validator("date")
+    @classmethod
+    def default_date(cls, v: Optional[datetime]) -> datetime:
+        # Stored and echoed as UTC so POST responses match later reads
+        if v is None:
+            return datetime.now(timezone.utc)
+        if v.tzinfo is None:
+            return v.replace(tzinfo=timezone.utc)
+        return v.astimezone(timezone.utc)
 
 # Example schemas (kept for reference; not used by app)
 class User(BaseModel):
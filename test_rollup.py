@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from rollup import format_month, month_key, rollup_month, summarize_rollup
+
+
+def test_naive_datetime_is_taken_as_utc():
+    assert format_month(month_key(datetime(2024, 3, 31, 23, 30))) == "2024-03"
+
+
+def test_aware_datetime_is_bucketed_in_utc():
+    # 2024-03-31 20:30 at -05:00 is 2024-04-01 01:30 UTC
+    dt = datetime(2024, 3, 31, 20, 30, tzinfo=timezone(timedelta(hours=-5)))
+    assert format_month(month_key(dt)) == "2024-04"
+    assert month_key(dt) == month_key(datetime(2024, 4, 1, tzinfo=timezone.utc))
+
+
+def test_year_boundaries():
+    assert format_month(month_key(datetime(2023, 12, 15))) == "2023-12"
+    assert format_month(month_key(datetime(2024, 1, 1))) == "2024-01"
+    assert month_key(datetime(2024, 1, 1)) - month_key(datetime(2023, 12, 1)) == 1
+
+
+def test_non_dates_have_no_month():
+    assert month_key(None) is None
+    assert month_key("2024-03-01") is None
+    assert month_key(1709251200) is None
+    assert format_month(None) == "unknown"
+
+
+def test_rollup_month_falls_back_to_created_at():
+    created = datetime(2024, 5, 2, tzinfo=timezone.utc)
+    assert format_month(rollup_month({"created_at": created})) == "2024-05"
+    assert format_month(rollup_month({"date": None, "created_at": created})) == "2024-05"
+    assert format_month(rollup_month({"date": datetime(2024, 6, 1), "created_at": created})) == "2024-06"
+
+
+def test_rollup_month_without_any_date_is_unknown():
+    assert format_month(rollup_month({})) == "unknown"
+    # A non-date date is not replaced by created_at, mirroring $ifNull in MONTH_KEY_EXPR
+    assert format_month(rollup_month({"date": "soon", "created_at": datetime(2024, 5, 2)})) == "unknown"
+
+
+class FakeCursor:
+    """Async iterable standing in for a Motor cursor over summary_rollup"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._rows)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def summarize(rows):
+    return asyncio.run(summarize_rollup(FakeCursor(rows)))
+
+
+def test_summarize_rollup_empty():
+    s = summarize([])
+    assert s["count"] == 0
+    assert s["total_expense"] == 0.0
+    assert s["monthly"] == {}
+    assert s["top_categories"] == []
+    assert s["avg_monthly_expense"] == 0.0
+
+
+def test_summarize_rollup_folds_rows():
+    mar, apr = month_key(datetime(2024, 3, 1)), month_key(datetime(2024, 4, 1))
+    s = summarize([
+        {"month": mar, "category": "Dining", "type": "expense", "total": 100.0, "count": 4},
+        {"month": apr, "category": "Dining", "type": "expense", "total": 50.0, "count": 2},
+        {"month": mar, "category": "Rent", "type": "expense", "total": 900.0, "count": 1},
+        {"month": mar, "category": "Salary", "type": "income", "total": 3000.0, "count": 1},
+        {"month": None, "category": "Misc", "type": "expense", "total": 10.0, "count": 1},
+    ])
+    assert s["count"] == 9
+    assert s["total_expense"] == 1060.0
+    assert s["total_income"] == 3000.0
+    assert s["net"] == 1940.0
+    assert s["by_category"] == {"Dining": 150.0, "Rent": 900.0, "Misc": 10.0}
+    assert s["monthly"] == {
+        "2024-03": {"expense": 1000.0, "income": 3000.0},
+        "2024-04": {"expense": 50.0, "income": 0.0},
+        "unknown": {"expense": 10.0, "income": 0.0},
+    }
+    assert [c["category"] for c in s["top_categories"]] == ["Rent", "Dining", "Misc"]
+    assert s["avg_monthly_expense"] == 353.33
+
+
+def test_summarize_rollup_keeps_top_five():
+    rows = [
+        {"month": 0, "category": f"c{i}", "type": "expense", "total": float(i), "count": 1}
+        for i in range(8)
+    ]
+    assert [c["category"] for c in summarize(rows)["top_categories"]] == ["c7", "c6", "c5", "c4", "c3"]